@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import argparse
+import math
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional
 
+import diskcache
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
 UA = "EI01K-CPU-Exporter/1.0 (Wikipedia+Wikidata; personal script)"
 
@@ -17,6 +23,12 @@ WDQS_ENDPOINT = "https://query.wikidata.org/sparql"
 DEFAULT_IN_PATH = Path("cpus") / "INTEL_CPU_LIST.txt"
 DEFAULT_OUT_PATH = Path("cpus") / "ALL_INTEL_CPU.txt"
 
+# Wikipedia/WDQSの結果をディスクにキャッシュ（再実行時やCPU追加時の再取得を避ける）
+CACHE_DIR = Path(".cache") / "intcpu"
+CACHE_EXPIRE = 30 * 86400  # 秒
+CACHE = diskcache.Cache(str(CACHE_DIR))
+_MISS = object()
+
 # 周波数の単位(QID) 変換用
 UNIT_TO_GHZ = {
     "http://www.wikidata.org/entity/Q3276763": 1.0,  # gigahertz
@@ -25,6 +37,50 @@ UNIT_TO_GHZ = {
     "http://www.wikidata.org/entity/Q39369": 1.0 / 1_000_000_000,  # hertz
 }
 
+_QID_RE = re.compile(r"Q\d+")
+# freqs_raw の1要素 "amount|unit" (要素は ';' 区切り)
+_FREQ_RE = re.compile(r"(?:^|(?<=;))\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*\|([^;]*)")
+
+# Wikipedia問い合わせの並列数と全体のレート上限(req/s)
+# WIKI_BATCH: 1リクエストでまとめて引くタイトル数(MediaWiki APIの上限は50)
+WIKI_BATCH = 50
+WIKI_WORKERS = 8
+WIKI_MAX_RPS = 10.0
+
+# WDQSは1IPあたり同時5クエリまでなので、4並列に抑える
+WDQS_BATCH = 500
+WDQS_WORKERS = 4
+WDQS_SEMAPHORE = threading.Semaphore(WDQS_WORKERS)
+
+# TCP/TLS接続を使い回すための共有セッション
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": UA})
+_ADAPTER = HTTPAdapter(pool_connections=len(WIKI_LANGS) + 1, pool_maxsize=16)
+SESSION.mount("https://", _ADAPTER)
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter: allows at most `rate` calls per second in total.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self._interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+WIKI_LIMITER = RateLimiter(WIKI_MAX_RPS)
+
 
 def read_cpu_list(path: Path) -> List[str]:
     text = path.read_text(encoding="utf-8")
@@ -35,50 +91,87 @@ def read_cpu_list(path: Path) -> List[str]:
             names.append(s)
     return names
 
-def wikipedia_qid(title: str) -> Optional[Tuple[str, str]]:
+def wikipedia_qids_bulk(titles: List[str], lang: str, session: requests.Session = SESSION) -> Dict[str, str]:
     """
-    Returns (qid, lang) if found.
-    Uses MediaWiki API prop=pageprops to get wikibase_item.
+    Resolve up to WIKI_BATCH titles with a single MediaWiki API call.
+    Returns {original title: qid} for the titles that have a wikibase_item.
+    Follows 'normalized' and 'redirects' so the original titles can be mapped back.
+    Safe to call from multiple threads (rate-limited via WIKI_LIMITER).
+    Results (including misses) are cached per (lang, title) in CACHE.
     """
-    for lang in WIKI_LANGS:
-        url = WIKI_API.format(lang=lang)
-        params = {
-            "action": "query",
-            "format": "json",
-            "redirects": 1,
-            "prop": "pageprops",
-            "ppprop": "wikibase_item",
-            "titles": title,
-        }
-        r = requests.get(url, params=params, headers={"User-Agent": UA}, timeout=20)
-        r.raise_for_status()
-        data = r.json()
-        pages = data.get("query", {}).get("pages", {})
-        # pages is a dict keyed by pageid
-        for _, p in pages.items():
-            if "missing" in p:
-                continue
-            qid = p.get("pageprops", {}).get("wikibase_item")
-            if qid and re.fullmatch(r"Q\d+", qid):
-                return (qid, lang)
-        time.sleep(0.1)
-    return None
-
-def chunked(xs: List[str], n: int) -> List[List[str]]:
-    return [xs[i:i+n] for i in range(0, len(xs), n)]
+    out: Dict[str, str] = {}
+    misses: List[str] = []
+    for title in titles:
+        cached = CACHE.get(("wiki", lang, title), default=_MISS)
+        if cached is _MISS:
+            misses.append(title)
+        elif cached:
+            out[title] = cached
+    if not misses:
+        return out
+
+    params = {
+        "action": "query",
+        "format": "json",
+        "redirects": 1,
+        "prop": "pageprops",
+        "ppprop": "wikibase_item",
+        "titles": "|".join(misses),
+    }
+    WIKI_LIMITER.wait()
+    r = session.get(WIKI_API.format(lang=lang), params=params, timeout=20)
+    r.raise_for_status()
+    data = orjson.loads(r.content)
+    # maxlag/ratelimited 等のAPIエラーはHTTP 200で返る。ミスとしてキャッシュしないよう例外にする
+    if "error" in data or "query" not in data:
+        raise RuntimeError(f"MediaWiki API error ({lang}): {data.get('error', data)}")
+    query = data["query"]
+
+    normalized = {n["from"]: n["to"] for n in query.get("normalized", [])}
+    redirects = {n["from"]: n["to"] for n in query.get("redirects", [])}
+
+    # pages is a dict keyed by pageid
+    title_to_qid: Dict[str, str] = {}
+    for _, p in query.get("pages", {}).items():
+        if "missing" in p:
+            continue
+        qid = p.get("pageprops", {}).get("wikibase_item")
+        if qid and _QID_RE.fullmatch(qid):
+            title_to_qid[p["title"]] = qid
+
+    for title in misses:
+        t = normalized.get(title, title)
+        t = redirects.get(t, t)
+        qid = title_to_qid.get(t)
+        CACHE.set(("wiki", lang, title), qid or "", expire=CACHE_EXPIRE)
+        if qid:
+            out[title] = qid
+    return out
+
+def chunked(xs: List[str], n: int) -> Iterator[List[str]]:
+    for i in range(0, len(xs), n):
+        yield xs[i:i+n]
 
 def wdqs_fetch_specs(qids: List[str]) -> Dict[str, Dict[str, object]]:
     """
     For QIDs, fetch cores(P1141), threads(P7443), clock frequencies(P2149).
+    Results (including misses) are cached per QID in CACHE.
     """
     out: Dict[str, Dict[str, object]] = {}
-    if not qids:
+    misses: List[str] = []
+    for q in qids:
+        cached = CACHE.get(("wdqs", q), default=_MISS)
+        if cached is _MISS:
+            misses.append(q)
+        elif cached:
+            out[q] = cached
+    if not misses:
         return out
 
-    values = " ".join([f"wd:{q}" for q in qids])
+    values = " ".join([f"wd:{q}" for q in misses])
 
     sparql = f"""
-    SELECT ?item ?itemLabel
+    SELECT ?item
            (SAMPLE(?cores) AS ?cores)
            (SAMPLE(?threads) AS ?threads)
            (GROUP_CONCAT(DISTINCT CONCAT(STR(?freqAmount), "|", STR(?freqUnit)); separator=";") AS ?freqs)
@@ -94,36 +187,41 @@ def wdqs_fetch_specs(qids: List[str]) -> Dict[str, Dict[str, object]]:
         ?node wikibase:quantityAmount ?freqAmount.
         ?node wikibase:quantityUnit ?freqUnit.
       }}
-
-      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "ja,en". }}
     }}
-    GROUP BY ?item ?itemLabel
+    GROUP BY ?item
     """
 
-    r = requests.get(
-        WDQS_ENDPOINT,
-        params={"query": sparql, "format": "json"},
-        headers={"User-Agent": UA, "Accept": "application/sparql-results+json"},
-        timeout=30,
-    )
+    # POSTならURL長の制限を受けないので、VALUESを大きくできる
+    with WDQS_SEMAPHORE:
+        r = SESSION.post(
+            WDQS_ENDPOINT,
+            data={"query": sparql, "format": "json"},
+            headers={"Accept": "application/sparql-results+json"},
+            timeout=30,
+        )
     r.raise_for_status()
-    data = r.json()
+    data = orjson.loads(r.content)
+    # 結果の形をしていない応答は、ミスとしてキャッシュしないよう例外にする
+    if "results" not in data:
+        raise RuntimeError(f"Unexpected WDQS response: {data}")
 
-    for b in data.get("results", {}).get("bindings", []):
+    for b in data["results"].get("bindings", []):
         item_uri = b["item"]["value"]
         qid = item_uri.rsplit("/", 1)[-1]
-        label = b.get("itemLabel", {}).get("value", qid)
         cores = b.get("cores", {}).get("value")
         threads = b.get("threads", {}).get("value")
         freqs_raw = b.get("freqs", {}).get("value", "")
 
         out[qid] = {
-            "label": label,
+            "label": qid,
             "cores": int(float(cores)) if cores else None,
             "threads": int(float(threads)) if threads else None,
             "freqs_raw": freqs_raw,
         }
 
+    for q in misses:
+        CACHE.set(("wdqs", q), out.get(q), expire=CACHE_EXPIRE)
+
     return out
 
 def parse_freqs_to_str(freqs_raw: str) -> str:
@@ -134,35 +232,22 @@ def parse_freqs_to_str(freqs_raw: str) -> str:
     if not freqs_raw:
         return "?"
 
-    ghz_vals: List[float] = []
-    unknown_parts: List[str] = []
-
-    for part in freqs_raw.split(";"):
-        if not part.strip():
-            continue
-        if "|" not in part:
-            unknown_parts.append(part)
-            continue
-        amount_s, unit = part.split("|", 1)
-        try:
-            # amount can be like "+3.20"
-            amount = float(amount_s.replace("+", ""))
-        except ValueError:
-            unknown_parts.append(part)
-            continue
-
-        mul = UNIT_TO_GHZ.get(unit)
-        if mul is None:
-            unknown_parts.append(part)
-            continue
-        ghz_vals.append(amount * mul)
+    # (amount, unit) の組を一括で取り出す。amount は "+3.20" のような形もある
+    ghz_vals = [
+        float(amount) * UNIT_TO_GHZ[unit]
+        for amount, unit in _FREQ_RE.findall(freqs_raw)
+        if unit in UNIT_TO_GHZ
+    ]
+    # 桁数の大きすぎる値は inf になり整数MHzにできないので捨てる
+    ghz_vals = [x for x in ghz_vals if math.isfinite(x)]
 
     if ghz_vals:
-        ghz_vals = sorted(set(round(x, 3) for x in ghz_vals))
-        if len(ghz_vals) == 1:
-            x = ghz_vals[0]
-            return f"{trim_float(x)}GHz"
-        return f"{trim_float(ghz_vals[0])}–{trim_float(ghz_vals[-1])}GHz"
+        # 従来どおり round(x, 3) で丸めてから整数MHzにして比較する
+        mhz = [round(round(x, 3) * 1000) for x in ghz_vals]
+        lo, hi = min(mhz), max(mhz)
+        if lo == hi:
+            return f"{trim_float(lo / 1000)}GHz"
+        return f"{trim_float(lo / 1000)}–{trim_float(hi / 1000)}GHz"
 
     # 単位が取れない等：最低限、元の文字列を返す
     return freqs_raw
@@ -173,31 +258,34 @@ def trim_float(x: float) -> str:
     return s
 
 def build_lines(cpu_names: List[str]) -> List[str]:
-    # 1) WikipediaからQID収集
-    name_to_qid: Dict[str, Optional[str]] = {}
-    for name in cpu_names:
-        hit = wikipedia_qid(name)
-        if not hit:
-            name_to_qid[name] = None
-            continue
-        qid, _lang = hit
-        name_to_qid[name] = qid
+    # 1) WikipediaからQID収集（言語ごとに50件ずつまとめて、並列）
+    name_to_qid: Dict[str, Optional[str]] = {name: None for name in cpu_names}
+    # '|' はAPIのタイトル区切りなので、含む名前は引けない
+    pending = [name for name in name_to_qid if "|" not in name]
+    with ThreadPoolExecutor(max_workers=WIKI_WORKERS) as ex:
+        for lang in WIKI_LANGS:
+            if not pending:
+                break
+            batches = chunked(pending, WIKI_BATCH)
+            for found in ex.map(lambda b: wikipedia_qids_bulk(b, lang), batches):
+                name_to_qid.update(found)
+            pending = [name for name in pending if not name_to_qid[name]]
 
     qids = [q for q in name_to_qid.values() if q]
     qids_unique = sorted(set(qids))
 
-    # 2) WDQSでまとめて引く（200件ずつ）
+    # 2) WDQSでまとめて引く（500件ずつ、並列）
     specs: Dict[str, Dict[str, object]] = {}
-    for batch in chunked(qids_unique, 200):
-        specs.update(wdqs_fetch_specs(batch))
-        time.sleep(0.2)
+    with ThreadPoolExecutor(max_workers=WDQS_WORKERS) as ex:
+        for found in ex.map(wdqs_fetch_specs, chunked(qids_unique, WDQS_BATCH)):
+            specs.update(found)
 
     # 3) 出力（形式: "CPU名" "?C?T" "周波数"）
     out_lines: List[str] = []
     for name in cpu_names:
         qid = name_to_qid.get(name)
         if not qid:
-            out_lines.append(f"\"{name}\" \"?C?T\" \"?\"")
+            out_lines.append("".join(('"', name, '" "?C?T" "?"')))
             continue
 
         s = specs.get(qid, {})
@@ -208,7 +296,7 @@ def build_lines(cpu_names: List[str]) -> List[str]:
         ct = f"{cores if cores is not None else '?'}C{threads if threads is not None else '?'}T"
         freq_str = parse_freqs_to_str(freqs_raw if isinstance(freqs_raw, str) else "")
 
-        out_lines.append(f"\"{name}\" \"{ct}\" \"{freq_str}\"")
+        out_lines.append("".join(('"', name, '" "', ct, '" "', freq_str, '"')))
 
     return out_lines
 
@@ -244,7 +332,10 @@ def main() -> int:
     cpu_names = read_cpu_list(in_path)
     lines = build_lines(cpu_names)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text("\n".join(lines) + ("\n" if lines else ""), encoding="utf-8")
+    data = "\n".join(lines).encode("utf-8")
+    if lines:
+        data += b"\n"
+    out_path.write_bytes(data)
     print(f"Wrote {len(lines)} lines to: {out_path}")
     return 0
 
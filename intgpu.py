@@ -1,22 +1,26 @@
 from __future__ import annotations
 
+import re
 from dataclasses import dataclass
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
-from typing import Iterable, Optional, Tuple
+from typing import Iterable, Optional
 
 from dbgpu import GPUDatabase, GPUSpecification
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class IntelGpuRow:
 	name: str
 	memory_capacity: str
 	memory_type: str
 
 	def to_line(self) -> str:
-		return f"\"{self.name}\" \"{self.memory_capacity} {self.memory_type}\""
+		return "".join(('"', self.name, '" "', self.memory_capacity, " ", self.memory_type, '"'))
 
 
+@lru_cache(maxsize=64)
 def _format_memory_capacity(memory_size_gb: Optional[float]) -> str:
 	if memory_size_gb is None:
 		return "不明"
@@ -24,61 +28,86 @@ def _format_memory_capacity(memory_size_gb: Optional[float]) -> str:
 	if memory_size_gb <= 0:
 		return "0GB"
 
-	rounded = round(memory_size_gb)
-	if abs(memory_size_gb - rounded) < 1e-9:
-		return f"{int(rounded)}GB"
+	# ほとんどは整数GBなので、浮動小数の書式化を通さずに返す
+	iv = int(memory_size_gb)
+	if iv == memory_size_gb:
+		return f"{iv}GB"
 
 	s = f"{memory_size_gb:.3f}".rstrip("0").rstrip(".")
 	return f"{s}GB"
 
 
+# 同じ (名前, 容量, 種類) のspecは多いので、同一の行オブジェクトを使い回す
+@lru_cache(maxsize=2048)
+def _row_cached(
+	name: Optional[str],
+	memory_size_gb: Optional[float],
+	memory_type: Optional[str],
+) -> IntelGpuRow:
+	mem_capacity = _format_memory_capacity(memory_size_gb)
+	return IntelGpuRow(
+		name=(name or "").strip(),
+		memory_capacity=mem_capacity,
+		memory_type=(memory_type or "不明").strip(),
+	)
+
+
 def _row_from_spec(spec: GPUSpecification) -> IntelGpuRow:
-	name = (spec.name or "").strip()
-	mem_capacity = _format_memory_capacity(spec.memory_size_gb)
-	mem_type = (spec.memory_type or "不明").strip()
-	return IntelGpuRow(name=name, memory_capacity=mem_capacity, memory_type=mem_type)
+	return _row_cached(spec.name, spec.memory_size_gb, spec.memory_type)
 
 
-def _is_console_gpu_name(name: str) -> bool:
-	n = name.casefold()
-	console_markers = (
+_CONSOLE_RE = re.compile(
+	"|".join((
 		"playstation",
 		"psx",
 		"xbox",
 		"switch",
 		"nintendo",
-	)
-	return any(m in n for m in console_markers)
+	)),
+	re.IGNORECASE,
+)
+
+
+def _is_console_gpu_name(name: str) -> bool:
+	return _CONSOLE_RE.search(name) is not None
 
 
 def iter_intel_gpu_rows(specs: Iterable[GPUSpecification]) -> Iterable[IntelGpuRow]:
 	for spec in specs:
 		if spec.manufacturer != "Intel":
 			continue
+		# 行を作る前に生の名前で弾く(正規表現は大文字小文字を無視するので前処理は不要)
+		if spec.name and _is_console_gpu_name(spec.name):
+			continue
 		row = _row_from_spec(spec)
 		if not row.name:
 			continue
-		if _is_console_gpu_name(row.name):
-			continue
 		yield row
 
 
 def build_unique_sorted_rows(rows: Iterable[IntelGpuRow]) -> list[IntelGpuRow]:
-	unique: dict[Tuple[str, str, str], IntelGpuRow] = {}
+	# 行は frozen dataclass (name, memory_capacity, memory_type) なのでそのまま重複排除できる
+	# 1回の走査で重複排除とソートキー作成(name.lower() は1行1回)を済ませる
+	seen: set[IntelGpuRow] = set()
+	keyed: list[tuple[tuple[str, str, str], IntelGpuRow]] = []
 	for r in rows:
-		key = (r.name, r.memory_capacity, r.memory_type)
-		unique.setdefault(key, r)
-
-	def sort_key(r: IntelGpuRow) -> Tuple[str, str, str]:
-		return (r.name.lower(), r.memory_capacity, r.memory_type)
+		if r in seen:
+			continue
+		seen.add(r)
+		keyed.append(((r.name.lower(), r.memory_capacity, r.memory_type), r))
 
-	return sorted(unique.values(), key=sort_key)
+	# キーだけで安定ソートする
+	keyed.sort(key=itemgetter(0))
+	return [r for _, r in keyed]
 
 
 def write_rows(out_path: Path, rows: Iterable[IntelGpuRow]) -> int:
 	out_path.parent.mkdir(parents=True, exist_ok=True)
-	lines = [r.to_line() for r in rows]
-	out_path.write_text("\n".join(lines) + ("\n" if lines else ""), encoding="utf-8")
+	lines = [r.to_line().encode("utf-8") for r in rows]
+	data = b"\n".join(lines)
+	if lines:
+		data += b"\n"
+	out_path.write_bytes(data)
 	return len(lines)
 
 